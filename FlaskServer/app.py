@@ -5,45 +5,62 @@ PassCard Flask Server
 
 import os
 import json
-import uuid
+import base64
+import secrets
 import hashlib
+import logging
 import zipfile
 import io
 import threading
 import time
-import urllib.request
+from collections import OrderedDict
+from concurrent.futures import Future
 from datetime import datetime
+import orjson
 from flask import Flask, request, jsonify, send_file, Response, send_from_directory
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
 
 from pass_generator import PassGenerator
 
-app = Flask(__name__)
 
-# ============================================
-# Keep-Alive: предотвращает засыпание на Render
-# ============================================
-def keep_alive():
-    """Пингует сервер каждые 14 минут, чтобы не засыпал"""
-    server_url = os.environ.get('RENDER_EXTERNAL_URL') or os.environ.get('WEB_SERVICE_URL')
-    if not server_url:
-        print("⚠️ Keep-alive disabled: no RENDER_EXTERNAL_URL set")
-        return
+class OrjsonProvider(JSONProvider):
+    """JSON-провайдер Flask на orjson (jsonify, request.get_json)"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode('utf-8')
     
-    health_url = f"{server_url.rstrip('/')}/health"
-    print(f"🔄 Keep-alive enabled: will ping {health_url} every 14 minutes")
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
     
-    while True:
-        time.sleep(14 * 60)  # 14 минут
-        try:
-            urllib.request.urlopen(health_url, timeout=10)
-            print(f"[{datetime.now().isoformat()}] Keep-alive ping successful")
-        except Exception as e:
-            print(f"[{datetime.now().isoformat()}] Keep-alive ping failed: {e}")
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype='application/json')
+
+
+app = Flask(__name__)
+app.json = OrjsonProvider(app)
+
+# Логи приложения; access-лог в проде пишет gunicorn (--access-logfile -)
+logger = logging.getLogger('passcard')
+logger.setLevel(logging.DEBUG if os.environ.get('FLASK_DEBUG') else logging.INFO)
+if not logger.handlers:
+    log_handler = logging.StreamHandler()
+    log_handler.setFormatter(logging.Formatter('[%(asctime)s] %(message)s'))
+    logger.addHandler(log_handler)
+
 CORS(app)
 
 # Конфигурация
 PORT = int(os.environ.get('PORT', 3000))
+MAX_PASSES = int(os.environ.get('MAX_PASSES', 256))
+PKPASS_CHUNK_SIZE = 64 * 1024
+
+# Отдача готовых .pkpass через reverse proxy, без чтения файла в Python:
+# USE_X_SENDFILE=1 — заголовок X-Sendfile (Apache, lighttpd),
+# X_ACCEL_REDIRECT_PREFIX=/internal_passes/ — X-Accel-Redirect (nginx)
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE') == '1'
+X_ACCEL_REDIRECT_PREFIX = os.environ.get('X_ACCEL_REDIRECT_PREFIX')
 
 PASS_CONFIG = {
     'passTypeIdentifier': os.environ.get('PASS_TYPE_ID', 'pass.com.needsomevibe.passcard'),
@@ -58,24 +75,156 @@ CERTIFICATES_DIR = os.path.join(BASE_DIR, 'certificates')
 GENERATED_DIR = os.path.join(BASE_DIR, 'generated')
 TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
 
-# Хранилище пассов (в памяти)
-pass_store = {}
+
+class LRUCache:
+    """Потокобезопасный LRU-кэш с ограниченной ёмкостью"""
+    
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            return self._data[key]
+    
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.capacity:
+                self._data.popitem(last=False)
+    
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+    
+    def items(self):
+        with self._lock:
+            return list(self._data.items())
+
+
+# Метаданные пассов (в памяти, только последние MAX_PASSES;
+# сами .pkpass лежат в GENERATED_DIR)
+pass_store = LRUCache(MAX_PASSES)
+
+# Готовый JSON для GET /api/passes; сбрасывается при любом изменении pass_store
+listing_body = None
+listing_lock = threading.Lock()
+
+
+def invalidate_listing():
+    """Сброс закэшированного списка пассов"""
+    global listing_body
+    with listing_lock:
+        listing_body = None
+
+
+# Хэш содержимого запроса → серийный номер (повторы и двойные нажатия)
+recent_passes = LRUCache(MAX_PASSES)
 
 # Создаём директории
 for dir_path in [CERTIFICATES_DIR, GENERATED_DIR, TEMPLATES_DIR]:
     os.makedirs(dir_path, exist_ok=True)
 
 
+def pass_path(serial_number):
+    """Путь к .pkpass в GENERATED_DIR (serial_number не содержит '/': так его разбирает роутинг)"""
+    return f"{GENERATED_DIR}/{serial_number}.pkpass"
+
+
+def accel_redirect(serial_number, headers=None):
+    """Пустой ответ с X-Accel-Redirect: файл из GENERATED_DIR отдаёт сам nginx"""
+    return Response(
+        mimetype='application/vnd.apple.pkpass',
+        headers={
+            'X-Accel-Redirect': f"{X_ACCEL_REDIRECT_PREFIX}{serial_number}.pkpass",
+            **(headers or {})
+        }
+    )
+
+
+# Генератор пассов — один на процесс, сертификаты загружаются один раз
+generator = PassGenerator(PASS_CONFIG, CERTIFICATES_DIR, TEMPLATES_DIR)
+
+def write_pass_file(file_path, ticket, serial_number, images=None, images_raw=None):
+    """
+    Генерирует .pkpass сразу в файл: архив не собирается в памяти целиком.
+    Запись атомарная — во временный файл и os.replace (без полузаписанных пассов).
+    Пишется в потоке запроса до ответа: воркеры gunicorn — отдельные процессы
+    с общим GENERATED_DIR, и пасс должен быть на диске, когда его запросит любой из них.
+    """
+    tmp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            generator.generate_pass_to(f, ticket, serial_number, images, images_raw)
+        os.replace(tmp_path, file_path)
+    except Exception:
+        # Ошибку с трейсбеком логирует обработчик запроса, клиент получает 500
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def discard_pass_file(file_path):
+    """Удаляет пасс с диска"""
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
+
+
+def send_stored_pass(serial_number, as_attachment=False):
+    """Отдаёт сохранённый пасс с диска; None, если его нет"""
+    stored = pass_store.get(serial_number)
+    # Метаданные могли вытесниться из LRU или пропасть при рестарте — файл при этом остаётся
+    file_path = stored['path'] if stored else pass_path(serial_number)
+    download_name = f"{serial_number}.pkpass" if as_attachment else None
+    
+    if not os.path.exists(file_path):
+        return None
+    
+    if X_ACCEL_REDIRECT_PREFIX:
+        return accel_redirect(serial_number, {
+            'Content-Disposition': f'attachment; filename="{download_name}"'
+        } if as_attachment else None)
+    
+    # Отдаём потоком, без чтения в память; Last-Modified берётся из mtime файла, If-Modified-Since → 304
+    return send_file(
+        file_path,
+        mimetype='application/vnd.apple.pkpass',
+        as_attachment=as_attachment,
+        download_name=download_name,
+        conditional=True
+    )
+
+
+def send_new_pass(serial_number):
+    """Ответ на создание/обновление: файл пасса вложением и X-Serial-Number"""
+    response = send_stored_pass(serial_number, as_attachment=True)
+    if response is None:
+        # Пасс удалили параллельным запросом
+        return jsonify({
+            'success': False,
+            'error': 'Pass not found'
+        }), 404
+    response.headers['X-Serial-Number'] = serial_number
+    return response
+
+
 @app.before_request
 def log_request():
-    """Логирование запросов"""
-    print(f"[{datetime.now().isoformat()}] {request.method} {request.path}")
+    """Логирование запросов (debug; health-пинги не логируем)"""
+    if request.path != '/health':
+        logger.debug('%s %s', request.method, request.path)
 
 
-@app.route('/', methods=['GET'])
-def index():
-    """Main page"""
-    return '''
+# Статические страницы: кодируются в UTF-8 один раз при импорте
+INDEX_HTML = '''
     <!DOCTYPE html>
     <html>
     <head>
@@ -106,28 +255,10 @@ def index():
         </div>
     </body>
     </html>
-    '''
+    '''.encode('utf-8')
 
-
-@app.route('/health', methods=['GET'])
-def health():
-    """Health check"""
-    return jsonify({
-        'status': 'ok',
-        'timestamp': datetime.now().isoformat(),
-        'version': '1.0.0'
-    })
-
-
-@app.route('/privacy', methods=['GET'])
-@app.route('/privacy-policy', methods=['GET'])
-def privacy_policy():
-    """Privacy Policy page"""
-    try:
-        return send_from_directory(TEMPLATES_DIR, 'privacy.html')
-    except:
-        # Fallback if file not found
-        return '''
+# Запасные страницы, если в templates/ нет privacy.html / support.html
+PRIVACY_FALLBACK_HTML = '''
         <!DOCTYPE html>
         <html><head><meta charset="UTF-8"><meta name="viewport" content="width=device-width, initial-scale=1.0"><title>Privacy Policy - PassCard</title>
         <style>body{font-family:-apple-system,sans-serif;max-width:800px;margin:0 auto;padding:40px 20px;line-height:1.6}h1{color:#1d1d1f}h2{margin-top:30px;color:#1d1d1f}p{color:#424245}.highlight{background:#f0f0f5;padding:20px;border-radius:12px;margin:20px 0}</style></head>
@@ -144,17 +275,9 @@ def privacy_policy():
         <h2>Contact</h2>
         <p>Questions? Email us at <a href="mailto:miorauz@gmail.com">miorauz@gmail.com</a></p>
         </body></html>
-        '''
-
+        '''.encode('utf-8')
 
-@app.route('/support', methods=['GET'])
-def support():
-    """Support page"""
-    try:
-        return send_from_directory(TEMPLATES_DIR, 'support.html')
-    except:
-        # Fallback if file not found
-        return '''
+SUPPORT_FALLBACK_HTML = '''
         <!DOCTYPE html>
         <html><head><meta charset="UTF-8"><meta name="viewport" content="width=device-width, initial-scale=1.0"><title>Support - PassCard</title>
         <style>body{font-family:-apple-system,sans-serif;max-width:800px;margin:0 auto;padding:40px 20px;line-height:1.6}h1{color:#1d1d1f}h2{margin-top:30px}.contact{background:linear-gradient(135deg,#667eea,#764ba2);color:white;padding:30px;border-radius:16px;text-align:center;margin:20px 0}.contact a{color:white;font-size:18px}.faq{background:#f5f5f7;padding:20px;border-radius:12px;margin:15px 0}h3{margin-bottom:8px}</style></head>
@@ -168,14 +291,152 @@ def support():
         <div class="faq"><h3>Server Error?</h3><p>Check your internet connection. If it persists, check Settings in the app.</p></div>
         <p style="margin-top:40px;color:#86868b"><a href="/privacy">Privacy Policy</a></p>
         </body></html>
-        '''
+        '''.encode('utf-8')
+
+# Наличие шаблонов проверяется один раз, а не через try/except на каждый запрос
+HAS_PRIVACY_HTML = os.path.exists(os.path.join(TEMPLATES_DIR, 'privacy.html'))
+HAS_SUPPORT_HTML = os.path.exists(os.path.join(TEMPLATES_DIR, 'support.html'))
+
+
+@app.route('/', methods=['GET'])
+def index():
+    """Main page"""
+    return Response(INDEX_HTML, mimetype='text/html')
+
+
+# Постоянные JSON-ответы сериализуются один раз при импорте
+HEALTH_PREFIX = b'{"status":"ok","version":"1.0.0","timestamp":"'
+NOT_FOUND_BODY = orjson.dumps({'error': 'Not found'})
+
+
+@app.route('/health', methods=['GET'])
+def health():
+    """Health check"""
+    body = HEALTH_PREFIX + datetime.now().isoformat().encode() + b'"}'
+    return Response(body, mimetype='application/json')
+
+
+@app.route('/privacy', methods=['GET'])
+@app.route('/privacy-policy', methods=['GET'])
+def privacy_policy():
+    """Privacy Policy page"""
+    if HAS_PRIVACY_HTML:
+        return send_from_directory(TEMPLATES_DIR, 'privacy.html')
+    return Response(PRIVACY_FALLBACK_HTML, mimetype='text/html')
+
+
+@app.route('/support', methods=['GET'])
+def support():
+    """Support page"""
+    if HAS_SUPPORT_HTML:
+        return send_from_directory(TEMPLATES_DIR, 'support.html')
+    return Response(SUPPORT_FALLBACK_HTML, mimetype='text/html')
+
+
+def read_pass_request():
+    """
+    Разбор тела запроса на создание/обновление пасса: (data, images, images_raw).
+    multipart/form-data: поле ticket (JSON) и картинки файлами logo/icon/background —
+    потоки загрузки уходят в генератор как есть (images_raw), без base64.
+    application/json: картинки в base64 (устарело, оставлено для старых версий приложения).
+    """
+    if request.mimetype == 'multipart/form-data':
+        if 'ticket' not in request.form:
+            return None, {}, {}
+        ticket = orjson.loads(request.form['ticket'])
+        # ticket должен быть объектом — иначе 400, а не падение в генераторе
+        if not isinstance(ticket, dict):
+            return None, {}, {}
+        data = {
+            'ticket': ticket,
+            'deviceId': request.form.get('deviceId')
+        }
+        images_raw = {
+            name: request.files[name].stream
+            for name in ('logo', 'icon', 'background')
+            if request.files.get(name)
+        }
+        return data, {}, images_raw
+    
+    body = request.get_data(cache=False)
+    if not body:
+        return None, {}, {}
+    data = orjson.loads(body)
+    # Тело и ticket должны быть объектами ([1], "x", 42 → 400, как и раньше)
+    if not isinstance(data, dict) or not isinstance(data.get('ticket'), dict):
+        return None, {}, {}
+    images = {
+        'logo': data.get('logoImageBase64'),
+        'icon': data.get('iconImageBase64'),
+        'background': data.get('backgroundImageBase64')
+    }
+    return data, images, {}
+
+
+def pass_digest(ticket, device_id, images):
+    """Хэш ticket + deviceId + картинок: одинаковый запрос даёт одинаковый пасс"""
+    h = hashlib.blake2b(digest_size=16)
+    
+    def field(data):
+        # Длина перед каждым полем: разные разбиения одних и тех же байт дают разный хэш
+        h.update(len(data).to_bytes(8, 'big'))
+        h.update(data)
+    
+    field(orjson.dumps(ticket, option=orjson.OPT_SORT_KEYS))
+    # orjson, а не str(): None и "None" различаются
+    field(orjson.dumps(device_id))
+    for name in sorted(images):
+        image = images[name]
+        if not image:
+            continue
+        field(name.encode())
+        # Картинка — собственным хэшем фиксированной длины (потоки читаются кусками)
+        image_hash = hashlib.blake2b(digest_size=16)
+        if hasattr(image, 'read'):
+            for chunk in iter(lambda: image.read(PKPASS_CHUNK_SIZE), b''):
+                image_hash.update(chunk)
+            image.seek(0)
+        else:
+            image_hash.update(image.encode())
+        field(image_hash.digest())
+    return h.hexdigest()
+
+
+# Генерации, которые выполняются прямо сейчас: key → Future с результатом
+inflight = {}
+inflight_lock = threading.Lock()
+
+
+def coalesce(key, build):
+    """Вызывает build() один раз на все одновременные запросы с одинаковым key"""
+    with inflight_lock:
+        future = inflight.get(key)
+        owner = future is None
+        if owner:
+            future = inflight[key] = Future()
+    
+    # Такой же запрос уже обрабатывается — ждём его результат
+    if not owner:
+        return future.result(timeout=30)
+    
+    try:
+        result = build()
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        with inflight_lock:
+            del inflight[key]
 
 
 @app.route('/api/passes/create', methods=['POST'])
 def create_pass():
     """Создание нового пасса"""
     try:
-        data = request.get_json()
+        data, images, images_raw = read_pass_request()
         
         if not data or 'ticket' not in data:
             return jsonify({
@@ -185,56 +446,47 @@ def create_pass():
         
         ticket = data['ticket']
         device_id = data.get('deviceId')
-        logo_image = data.get('logoImageBase64')
-        icon_image = data.get('iconImageBase64')
-        background_image = data.get('backgroundImageBase64')
-        
-        # Генерируем серийный номер
-        serial_number = f"PASS-{int(datetime.now().timestamp() * 1000)}-{uuid.uuid4().hex[:8].upper()}"
-        
-        # Создаём генератор
-        generator = PassGenerator(PASS_CONFIG, CERTIFICATES_DIR, TEMPLATES_DIR)
         
-        # Генерируем пасс
-        pass_data = generator.generate_pass(
-            ticket=ticket,
-            serial_number=serial_number,
-            images={
-                'logo': logo_image,
-                'icon': icon_image,
-                'background': background_image
-            }
-        )
-        
-        # Сохраняем в хранилище
-        pass_store[serial_number] = {
-            'ticket': ticket,
-            'deviceId': device_id,
-            'createdAt': datetime.now().isoformat(),
-            'passData': pass_data
-        }
+        # Такой пасс уже создавали — отдаём готовый файл без повторной генерации
+        digest = pass_digest(ticket, device_id, {**images, **images_raw})
+        serial_number = recent_passes.get(digest)
+        stored = pass_store.get(serial_number) if serial_number else None
+        if stored and stored.get('digest') == digest:
+            response = send_stored_pass(serial_number, as_attachment=True)
+            if response is not None:
+                response.headers['X-Serial-Number'] = serial_number
+                return response
         
-        # Сохраняем файл
-        file_path = os.path.join(GENERATED_DIR, f"{serial_number}.pkpass")
-        with open(file_path, 'wb') as f:
-            f.write(pass_data)
+        def build():
+            # Генерируем серийный номер: миллисекунды + 8 символов base32 из 5 случайных байт
+            serial_number = f"PASS-{time.time_ns() // 1_000_000}-{base64.b32encode(secrets.token_bytes(5)).decode()}"
+            
+            # Генерируем пасс прямо в файл — до ответа и до записи метаданных
+            file_path = pass_path(serial_number)
+            write_pass_file(file_path, ticket, serial_number, images, images_raw)
+            
+            # Сохраняем в хранилище (только метаданные — сам пасс лежит на диске)
+            pass_store.set(serial_number, {
+                'ticket': ticket,
+                'deviceId': device_id,
+                'createdAt': datetime.now().isoformat(),
+                'digest': digest,
+                'path': file_path
+            })
+            recent_passes.set(digest, serial_number)
+            invalidate_listing()
+            
+            print(f"✅ Pass created: {serial_number}")
+            return serial_number
         
-        print(f"✅ Pass created: {serial_number}")
+        # Одновременные повторы того же запроса получают тот же пасс
+        serial_number = coalesce(('create', digest), build)
         
-        # Отправляем пасс
-        return Response(
-            pass_data,
-            mimetype='application/vnd.apple.pkpass',
-            headers={
-                'Content-Disposition': f'attachment; filename="{serial_number}.pkpass"',
-                'X-Serial-Number': serial_number
-            }
-        )
+        # Отправляем пасс (с диска, потоком)
+        return send_new_pass(serial_number)
         
     except Exception as e:
-        print(f"Error creating pass: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception('Error creating pass')
         return jsonify({
             'success': False,
             'error': str(e)
@@ -245,31 +497,9 @@ def create_pass():
 def get_pass(serial_number):
     """Получение существующего пасса"""
     try:
-        # Проверяем в хранилище
-        stored = pass_store.get(serial_number)
-        
-        if stored and stored.get('passData'):
-            return Response(
-                stored['passData'],
-                mimetype='application/vnd.apple.pkpass',
-                headers={
-                    'Content-Disposition': f'attachment; filename="{serial_number}.pkpass"'
-                }
-            )
-        
-        # Проверяем файл
-        file_path = os.path.join(GENERATED_DIR, f"{serial_number}.pkpass")
-        
-        if os.path.exists(file_path):
-            with open(file_path, 'rb') as f:
-                pass_data = f.read()
-            return Response(
-                pass_data,
-                mimetype='application/vnd.apple.pkpass',
-                headers={
-                    'Content-Disposition': f'attachment; filename="{serial_number}.pkpass"'
-                }
-            )
+        response = send_stored_pass(serial_number, as_attachment=True)
+        if response is not None:
+            return response
         
         return jsonify({
             'success': False,
@@ -277,7 +507,7 @@ def get_pass(serial_number):
         }), 404
         
     except Exception as e:
-        print(f"Error getting pass: {e}")
+        logger.exception('Error getting pass')
         return jsonify({
             'success': False,
             'error': str(e)
@@ -288,7 +518,7 @@ def get_pass(serial_number):
 def update_pass(serial_number):
     """Обновление существующего пасса"""
     try:
-        data = request.get_json()
+        data, images, images_raw = read_pass_request()
         
         if not data or 'ticket' not in data:
             return jsonify({
@@ -297,49 +527,30 @@ def update_pass(serial_number):
             }), 400
         
         ticket = data['ticket']
-        logo_image = data.get('logoImageBase64')
-        icon_image = data.get('iconImageBase64')
-        background_image = data.get('backgroundImageBase64')
-        
-        # Создаём генератор
-        generator = PassGenerator(PASS_CONFIG, CERTIFICATES_DIR, TEMPLATES_DIR)
-        
-        # Генерируем обновлённый пасс
-        pass_data = generator.generate_pass(
-            ticket=ticket,
-            serial_number=serial_number,
-            images={
-                'logo': logo_image,
-                'icon': icon_image,
-                'background': background_image
-            }
-        )
-        
-        # Обновляем в хранилище
-        pass_store[serial_number] = {
-            'ticket': ticket,
-            'updatedAt': datetime.now().isoformat(),
-            'passData': pass_data
-        }
         
-        # Перезаписываем файл
-        file_path = os.path.join(GENERATED_DIR, f"{serial_number}.pkpass")
-        with open(file_path, 'wb') as f:
-            f.write(pass_data)
+        def build():
+            # Генерируем обновлённый пасс прямо в файл, до ответа
+            file_path = pass_path(serial_number)
+            write_pass_file(file_path, ticket, serial_number, images, images_raw)
+            
+            # Обновляем в хранилище
+            pass_store.set(serial_number, {
+                'ticket': ticket,
+                'updatedAt': datetime.now().isoformat(),
+                'path': file_path
+            })
+            invalidate_listing()
+            
+            print(f"✏️ Pass updated: {serial_number}")
         
-        print(f"✏️ Pass updated: {serial_number}")
+        # Повторы Wallet приходят почти одновременно — генерируем один раз
+        digest = pass_digest(ticket, None, {**images, **images_raw})
+        coalesce(('update', serial_number, digest), build)
         
-        return Response(
-            pass_data,
-            mimetype='application/vnd.apple.pkpass',
-            headers={
-                'Content-Disposition': f'attachment; filename="{serial_number}.pkpass"',
-                'X-Serial-Number': serial_number
-            }
-        )
+        return send_new_pass(serial_number)
         
     except Exception as e:
-        print(f"Error updating pass: {e}")
+        logger.exception('Error updating pass')
         return jsonify({
             'success': False,
             'error': str(e)
@@ -351,19 +562,19 @@ def delete_pass(serial_number):
     """Удаление пасса"""
     try:
         # Удаляем из хранилища
-        pass_store.pop(serial_number, None)
+        stored = pass_store.pop(serial_number, None)
+        invalidate_listing()
         
         # Удаляем файл
-        file_path = os.path.join(GENERATED_DIR, f"{serial_number}.pkpass")
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        file_path = stored['path'] if stored else pass_path(serial_number)
+        discard_pass_file(file_path)
         
         print(f"🗑️ Pass deleted: {serial_number}")
         
         return jsonify({'success': True})
         
     except Exception as e:
-        print(f"Error deleting pass: {e}")
+        logger.exception('Error deleting pass')
         return jsonify({
             'success': False,
             'error': str(e)
@@ -373,23 +584,28 @@ def delete_pass(serial_number):
 @app.route('/api/passes', methods=['GET'])
 def list_passes():
     """Список всех пассов"""
+    global listing_body
     try:
-        passes = [
-            {
-                'serialNumber': sn,
-                'eventName': data.get('ticket', {}).get('eventName'),
-                'createdAt': data.get('createdAt')
-            }
-            for sn, data in pass_store.items()
-        ]
+        with listing_lock:
+            if listing_body is None:
+                passes = [
+                    {
+                        'serialNumber': sn,
+                        'eventName': data.get('ticket', {}).get('eventName'),
+                        'createdAt': data.get('createdAt')
+                    }
+                    for sn, data in pass_store.items()
+                ]
+                listing_body = orjson.dumps({
+                    'success': True,
+                    'passes': passes
+                })
+            body = listing_body
         
-        return jsonify({
-            'success': True,
-            'passes': passes
-        })
+        return Response(body, mimetype='application/json')
         
     except Exception as e:
-        print(f"Error listing passes: {e}")
+        logger.exception('Error listing passes')
         return jsonify({
             'success': False,
             'error': str(e)
@@ -426,16 +642,9 @@ def get_updated_passes(device_id, pass_type_id):
 @app.route('/api/passes/v1/passes/<pass_type_id>/<serial_number>', methods=['GET'])
 def get_pass_for_update(pass_type_id, serial_number):
     """Получение обновлённого пасса"""
-    stored = pass_store.get(serial_number)
-    
-    if stored and stored.get('passData'):
-        return Response(
-            stored['passData'],
-            mimetype='application/vnd.apple.pkpass',
-            headers={
-                'Last-Modified': stored.get('createdAt', datetime.now().isoformat())
-            }
-        )
+    response = send_stored_pass(serial_number)
+    if response is not None:
+        return response
     
     return '', 304
 
@@ -449,7 +658,7 @@ def device_log():
 
 @app.errorhandler(404)
 def not_found(e):
-    return jsonify({'error': 'Not found'}), 404
+    return Response(NOT_FOUND_BODY, status=404, mimetype='application/json')
 
 
 @app.errorhandler(500)
@@ -461,7 +670,7 @@ def server_error(e):
 
 
 def start_server():
-    """Запуск сервера с keep-alive"""
+    """Баннер при локальном запуске"""
     print(f"""
 ╔═══════════════════════════════════════════════════╗
 ║                                                   ║
@@ -477,18 +686,9 @@ def start_server():
 ║                                                   ║
 ╚═══════════════════════════════════════════════════╝
     """)
-    
-    # Запускаем keep-alive в отдельном потоке
-    if os.environ.get('RENDER_EXTERNAL_URL') or os.environ.get('WEB_SERVICE_URL'):
-        keep_alive_thread = threading.Thread(target=keep_alive, daemon=True)
-        keep_alive_thread.start()
-
-
-# Для gunicorn на Render - вызываем start_server при импорте
-if os.environ.get('RENDER') or os.environ.get('RENDER_EXTERNAL_URL'):
-    start_server()
 
 
 if __name__ == '__main__':
+    # Локальная разработка; в проде приложение запускает gunicorn (см. Procfile)
     start_server()
-    app.run(host='0.0.0.0', port=PORT, debug=False)
+    app.run(host='0.0.0.0', port=PORT, debug=False, threaded=True)
@@ -4,67 +4,210 @@ Generates and signs Apple Wallet passes (.pkpass)
 """
 
 import os
-import json
 import hashlib
-import secrets
 import zipfile
 import io
 import base64
+import shutil
+import functools
+import time
+import threading
 from datetime import datetime
 
+import orjson
 from cryptography import x509
 from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.serialization import pkcs7
 from cryptography.hazmat.backends import default_backend
 
+# Chunk size for streaming entries into the archive
+COPY_CHUNK_SIZE = 64 * 1024
+
+# Authentication tokens are sliced from os.urandom batches of this size
+ENTROPY_BATCH_SIZE = 4096
+
+# Minimal transparent PNG used when there is no icon
+PLACEHOLDER_PNG = bytes([
+    0x89, 0x50, 0x4E, 0x47, 0x0D, 0x0A, 0x1A, 0x0A,
+    0x00, 0x00, 0x00, 0x0D, 0x49, 0x48, 0x44, 0x52,
+    0x00, 0x00, 0x00, 0x01, 0x00, 0x00, 0x00, 0x01,
+    0x08, 0x02, 0x00, 0x00, 0x00, 0x90, 0x77, 0x53,
+    0xDE, 0x00, 0x00, 0x00, 0x0C, 0x49, 0x44, 0x41,
+    0x54, 0x08, 0xD7, 0x63, 0xF8, 0x00, 0x00, 0x00,
+    0x01, 0x00, 0x01, 0x00, 0x05, 0xFE, 0xD4, 0xE7,
+    0x00, 0x00, 0x00, 0x00, 0x49, 0x45, 0x4E, 0x44,
+    0xAE, 0x42, 0x60, 0x82
+])
+PLACEHOLDER_SHA1 = hashlib.sha1(PLACEHOLDER_PNG).hexdigest()
+
+
+@functools.lru_cache(maxsize=4)
+def read_certificates(signer_cert_path, signer_key_path, wwdr_cert_path, key_password, mtimes):
+    """Parse PEM certificates and signer key; cached per process, mtimes in the key pick up rotated files"""
+    with open(signer_cert_path, 'rb') as f:
+        signer_cert = x509.load_pem_x509_certificate(f.read(), default_backend())
+    
+    with open(signer_key_path, 'rb') as f:
+        signer_key = serialization.load_pem_private_key(
+            f.read(),
+            password=key_password,
+            backend=default_backend()
+        )
+    
+    with open(wwdr_cert_path, 'rb') as f:
+        wwdr_cert = x509.load_pem_x509_certificate(f.read(), default_backend())
+    
+    # Builders are immutable: the one with the signer bound is reused for every signature.
+    # WWDR is added per signature, after set_data(), which drops extra certificates in cryptography 41
+    signer = pkcs7.PKCS7SignatureBuilder().add_signer(
+        signer_cert,
+        signer_key,
+        hashes.SHA256()
+    )
+    
+    return {
+        'signer_cert': signer_cert,
+        'signer_key': signer_key,
+        'wwdr_cert': wwdr_cert,
+        'signer': signer
+    }
+
+
+@functools.lru_cache(maxsize=64)
+def sign_data(signer, wwdr_cert, data):
+    """Detached PKCS#7 signature over data; cached, so an identical manifest is signed only once"""
+    return signer.set_data(
+        data
+    ).add_certificate(
+        wwdr_cert
+    ).sign(
+        serialization.Encoding.DER,
+        options=[pkcs7.PKCS7Options.DetachedSignature]
+    )
+
+
+@functools.lru_cache(maxsize=8)
+def read_template_file(path, mtime):
+    """Template file contents and their SHA1, read and hashed in one pass; cached per (path, mtime)"""
+    data = bytearray()
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(COPY_CHUNK_SIZE), b''):
+            sha1.update(chunk)
+            data += chunk
+    return bytes(data), sha1.hexdigest()
+
+
+def read_template(path):
+    """(bytes, SHA1) of a template image, or (None, None) if the file is missing; re-read only when the file changes"""
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None, None
+    return read_template_file(path, mtime)
+
+
+@functools.lru_cache(maxsize=256)
+def hex_to_rgb_string(hex_color):
+    """'#RRGGBB' -> 'rgb(r, g, b)'; cached, since the same few colours repeat across passes"""
+    hex_color = hex_color.lstrip('#')
+    if len(hex_color) == 6:
+        r, g, b = bytes.fromhex(hex_color)
+        return f"rgb({r}, {g}, {b})"
+    return "rgb(0, 0, 0)"
+
+
+@functools.lru_cache(maxsize=256)
+def parse_iso(date_string):
+    """datetime.fromisoformat that accepts a trailing 'Z'; cached, the same date is formatted several times per pass"""
+    if date_string.endswith('Z'):
+        date_string = date_string[:-1] + '+00:00'
+    return datetime.fromisoformat(date_string)
+
+
+entropy_buffer = bytearray()
+entropy_lock = threading.Lock()
+
+
+def token_hex(nbytes):
+    """Like secrets.token_hex, but one os.urandom syscall serves many tokens"""
+    with entropy_lock:
+        if len(entropy_buffer) < nbytes:
+            entropy_buffer.extend(os.urandom(max(ENTROPY_BATCH_SIZE, nbytes)))
+        token = entropy_buffer[:nbytes]
+        del entropy_buffer[:nbytes]
+    return token.hex()
+
+
+def reset_entropy():
+    """Forked workers must not hand out the parent's buffered bytes"""
+    global entropy_lock
+    entropy_lock = threading.Lock()
+    entropy_buffer.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_entropy)
+
+
+class HashingReader:
+    """Read-only file wrapper that SHA1-hashes everything read through it"""
+    
+    def __init__(self, f):
+        self.f = f
+        self.hash = hashlib.sha1()
+    
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.hash.update(data)
+        return data
+    
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
 
 class PassGenerator:
+    # Pass type -> content generator method, resolved with getattr per call
+    CONTENT_GENERATORS = {
+        'eventTicket': 'generate_event_ticket_content',
+        'boardingPass': 'generate_boarding_pass_content',
+        'coupon': 'generate_coupon_content',
+        'storeCard': 'generate_store_card_content',
+        'generic': 'generate_generic_content'
+    }
+    
     def __init__(self, pass_config, certificates_dir, templates_dir):
         self.pass_config = pass_config
         self.certificates_dir = certificates_dir
         self.templates_dir = templates_dir
-        self.certificates = None
+        
+        # pass.json fields that depend only on the config: built once, copied for every pass
+        self.pass_json_base = {
+            'formatVersion': 1,
+            'passTypeIdentifier': pass_config['passTypeIdentifier'],
+            'teamIdentifier': pass_config['teamIdentifier']
+        }
+        if pass_config.get('webServiceURL'):
+            self.pass_json_base['webServiceURL'] = pass_config['webServiceURL']
     
     def load_certificates(self):
-        """Load certificates"""
-        if self.certificates:
-            return self.certificates
-        
+        """Load certificates (parsed once per process, re-read when the files change)"""
         try:
-            signer_cert_path = os.path.join(self.certificates_dir, 'signerCert.pem')
-            signer_key_path = os.path.join(self.certificates_dir, 'signerKey.pem')
-            wwdr_cert_path = os.path.join(self.certificates_dir, 'WWDR.pem')
-            
-            with open(signer_cert_path, 'rb') as f:
-                signer_cert = x509.load_pem_x509_certificate(f.read(), default_backend())
-            
-            with open(signer_key_path, 'rb') as f:
-                key_password = os.environ.get('PASS_KEY_PASSWORD', '').encode() or None
-                signer_key = serialization.load_pem_private_key(
-                    f.read(),
-                    password=key_password,
-                    backend=default_backend()
-                )
-            
-            with open(wwdr_cert_path, 'rb') as f:
-                wwdr_cert = x509.load_pem_x509_certificate(f.read(), default_backend())
-            
-            self.certificates = {
-                'signer_cert': signer_cert,
-                'signer_key': signer_key,
-                'wwdr_cert': wwdr_cert
-            }
-            return self.certificates
+            paths = tuple(
+                os.path.realpath(os.path.join(self.certificates_dir, name))
+                for name in ('signerCert.pem', 'signerKey.pem', 'WWDR.pem')
+            )
+            mtimes = tuple(os.stat(path).st_mtime_ns for path in paths)
+            key_password = os.environ.get('PASS_KEY_PASSWORD', '').encode() or None
+            return read_certificates(*paths, key_password, mtimes)
             
         except Exception as e:
             raise Exception(f"Failed to load certificates: {e}")
     
     def generate_pass_json(self, ticket, serial_number):
         """Generate pass.json based on ticket type"""
-        pass_json = {
-            'formatVersion': 1,
-            'passTypeIdentifier': self.pass_config['passTypeIdentifier'],
-            'teamIdentifier': self.pass_config['teamIdentifier'],
+        pass_json = self.pass_json_base.copy()
+        pass_json.update({
             'serialNumber': serial_number,
             'organizationName': ticket.get('organizationName', self.pass_config['organizationName']),
             'description': ticket.get('description') or ticket.get('eventName') or 'Pass',
@@ -78,16 +221,15 @@ class PassGenerator:
                 'message': ticket.get('barcodeMessage', serial_number),
                 'messageEncoding': 'iso-8859-1'
             }]
-        }
+        })
         
         # Logo text
         if ticket.get('logoText'):
             pass_json['logoText'] = ticket['logoText']
         
-        # Web Service URL
-        if self.pass_config.get('webServiceURL'):
-            pass_json['webServiceURL'] = self.pass_config['webServiceURL']
-            pass_json['authenticationToken'] = secrets.token_hex(16)
+        # Web Service URL (set in pass_json_base) needs a per-pass token
+        if 'webServiceURL' in pass_json:
+            pass_json['authenticationToken'] = token_hex(16)
         
         # Generate content based on pass type
         ticket_type = ticket.get('ticketType', 'eventTicket')
@@ -106,38 +248,24 @@ class PassGenerator:
         return pass_json
     
     def generate_pass_content(self, ticket, ticket_type):
-        """Generate pass content based on type"""
-        content = {
-            'headerFields': [],
-            'primaryFields': [],
-            'secondaryFields': [],
-            'auxiliaryFields': [],
-            'backFields': []
-        }
-        
-        generators = {
-            'eventTicket': self.generate_event_ticket_content,
-            'boardingPass': self.generate_boarding_pass_content,
-            'coupon': self.generate_coupon_content,
-            'storeCard': self.generate_store_card_content,
-            'generic': self.generate_generic_content
-        }
-        
-        generator = generators.get(ticket_type, self.generate_event_ticket_content)
-        return generator(ticket, content)
+        """Generate pass content based on type (field groups a pass doesn't use are omitted)"""
+        generator = getattr(self, self.CONTENT_GENERATORS.get(ticket_type, 'generate_event_ticket_content'))
+        return generator(ticket)
     
-    def generate_event_ticket_content(self, ticket, content):
+    def generate_event_ticket_content(self, ticket):
         """Event Ticket content"""
+        content = {}
+        
         # Header - time
         if ticket.get('eventTime'):
-            content['headerFields'].append({
+            content.setdefault('headerFields', []).append({
                 'key': 'time',
                 'label': 'TIME',
                 'value': self.format_time(ticket['eventTime'])
             })
         
         # Primary - event name
-        content['primaryFields'].append({
+        content.setdefault('primaryFields', []).append({
             'key': 'event',
             'label': 'EVENT',
             'value': ticket.get('eventName', 'Event')
@@ -145,14 +273,14 @@ class PassGenerator:
         
         # Secondary
         if ticket.get('venueName'):
-            content['secondaryFields'].append({
+            content.setdefault('secondaryFields', []).append({
                 'key': 'venue',
                 'label': 'VENUE',
                 'value': ticket['venueName']
             })
         
         if ticket.get('eventDate'):
-            content['secondaryFields'].append({
+            content.setdefault('secondaryFields', []).append({
                 'key': 'date',
                 'label': 'DATE',
                 'value': self.format_date(ticket['eventDate'])
@@ -161,21 +289,21 @@ class PassGenerator:
         # Auxiliary - seating
         seat_parts = []
         if ticket.get('seatSection'):
-            seat_parts.append(f"Sec {ticket['seatSection']}")
+            seat_parts.append('Sec %s' % ticket['seatSection'])
         if ticket.get('seatRow'):
-            seat_parts.append(f"Row {ticket['seatRow']}")
+            seat_parts.append('Row %s' % ticket['seatRow'])
         if ticket.get('seatNumber'):
-            seat_parts.append(f"Seat {ticket['seatNumber']}")
+            seat_parts.append('Seat %s' % ticket['seatNumber'])
         
         if seat_parts:
-            content['auxiliaryFields'].append({
+            content.setdefault('auxiliaryFields', []).append({
                 'key': 'seat',
                 'label': 'SEAT',
                 'value': ', '.join(seat_parts)
             })
         
         if ticket.get('ticketHolder'):
-            content['auxiliaryFields'].append({
+            content.setdefault('auxiliaryFields', []).append({
                 'key': 'holder',
                 'label': 'ATTENDEE',
                 'value': ticket['ticketHolder']
@@ -184,26 +312,26 @@ class PassGenerator:
         self.add_back_fields(content, ticket)
         return content
     
-    def generate_boarding_pass_content(self, ticket, content):
+    def generate_boarding_pass_content(self, ticket):
         """Boarding Pass content"""
-        content['transitType'] = 'PKTransitTypeAir'
+        content = {'transitType': 'PKTransitTypeAir'}
         
         # Header - gate
         if ticket.get('gate'):
-            content['headerFields'].append({
+            content.setdefault('headerFields', []).append({
                 'key': 'gate',
                 'label': 'GATE',
                 'value': ticket['gate']
             })
         
         # Primary - origin and destination
-        content['primaryFields'].append({
+        content.setdefault('primaryFields', []).append({
             'key': 'origin',
             'label': ticket.get('originCity', 'FROM'),
             'value': ticket.get('originCode', '---')
         })
         
-        content['primaryFields'].append({
+        content.setdefault('primaryFields', []).append({
             'key': 'destination',
             'label': ticket.get('destinationCity', 'TO'),
             'value': ticket.get('destinationCode', '---')
@@ -211,14 +339,14 @@ class PassGenerator:
         
         # Secondary
         if ticket.get('passengerName'):
-            content['secondaryFields'].append({
+            content.setdefault('secondaryFields', []).append({
                 'key': 'passenger',
                 'label': 'PASSENGER',
                 'value': ticket['passengerName']
             })
         
         if ticket.get('departureTime'):
-            content['secondaryFields'].append({
+            content.setdefault('secondaryFields', []).append({
                 'key': 'departure',
                 'label': 'DEPARTS',
                 'value': self.format_datetime(ticket['departureTime'])
@@ -226,28 +354,28 @@ class PassGenerator:
         
         # Auxiliary
         if ticket.get('flightNumber'):
-            content['auxiliaryFields'].append({
+            content.setdefault('auxiliaryFields', []).append({
                 'key': 'flight',
                 'label': 'FLIGHT',
                 'value': ticket['flightNumber']
             })
         
         if ticket.get('seatNumber'):
-            content['auxiliaryFields'].append({
+            content.setdefault('auxiliaryFields', []).append({
                 'key': 'seat',
                 'label': 'SEAT',
                 'value': ticket['seatNumber']
             })
         
         if ticket.get('seatClass'):
-            content['auxiliaryFields'].append({
+            content.setdefault('auxiliaryFields', []).append({
                 'key': 'class',
                 'label': 'CLASS',
                 'value': ticket['seatClass']
             })
         
         if ticket.get('boardingGroup'):
-            content['auxiliaryFields'].append({
+            content.setdefault('auxiliaryFields', []).append({
                 'key': 'group',
                 'label': 'GROUP',
                 'value': ticket['boardingGroup']
@@ -255,7 +383,7 @@ class PassGenerator:
         
         # Back fields
         if ticket.get('confirmationCode'):
-            content['backFields'].append({
+            content.setdefault('backFields', []).append({
                 'key': 'confirmation',
                 'label': 'Confirmation Code',
                 'value': ticket['confirmationCode']
@@ -264,10 +392,12 @@ class PassGenerator:
         self.add_back_fields(content, ticket)
         return content
     
-    def generate_coupon_content(self, ticket, content):
+    def generate_coupon_content(self, ticket):
         """Coupon content"""
+        content = {}
+        
         # Primary - discount/offer
-        content['primaryFields'].append({
+        content.setdefault('primaryFields', []).append({
             'key': 'offer',
             'label': ticket.get('storeName', 'OFFER'),
             'value': ticket.get('discountAmount') or ticket.get('couponTitle') or 'Special Offer'
@@ -275,14 +405,14 @@ class PassGenerator:
         
         # Secondary
         if ticket.get('couponTitle') and ticket.get('discountAmount'):
-            content['secondaryFields'].append({
+            content.setdefault('secondaryFields', []).append({
                 'key': 'title',
                 'label': 'PROMOTION',
                 'value': ticket['couponTitle']
             })
         
         if ticket.get('promoCode'):
-            content['secondaryFields'].append({
+            content.setdefault('secondaryFields', []).append({
                 'key': 'code',
                 'label': 'CODE',
                 'value': ticket['promoCode']
@@ -290,7 +420,7 @@ class PassGenerator:
         
         # Auxiliary
         if ticket.get('expirationDate'):
-            content['auxiliaryFields'].append({
+            content.setdefault('auxiliaryFields', []).append({
                 'key': 'expires',
                 'label': 'VALID UNTIL',
                 'value': self.format_date(ticket['expirationDate'])
@@ -298,7 +428,7 @@ class PassGenerator:
         
         # Back fields
         if ticket.get('termsAndConditions'):
-            content['backFields'].append({
+            content.setdefault('backFields', []).append({
                 'key': 'terms',
                 'label': 'Terms & Conditions',
                 'value': ticket['termsAndConditions']
@@ -307,17 +437,19 @@ class PassGenerator:
         self.add_back_fields(content, ticket)
         return content
     
-    def generate_store_card_content(self, ticket, content):
+    def generate_store_card_content(self, ticket):
         """Store Card content"""
+        content = {}
+        
         # Primary - balance or level
         if ticket.get('pointsBalance'):
-            content['primaryFields'].append({
+            content.setdefault('primaryFields', []).append({
                 'key': 'balance',
                 'label': 'POINTS',
                 'value': ticket['pointsBalance']
             })
         else:
-            content['primaryFields'].append({
+            content.setdefault('primaryFields', []).append({
                 'key': 'member',
                 'label': 'MEMBER',
                 'value': ticket.get('cardholderName', 'Member')
@@ -325,14 +457,14 @@ class PassGenerator:
         
         # Secondary
         if ticket.get('membershipLevel'):
-            content['secondaryFields'].append({
+            content.setdefault('secondaryFields', []).append({
                 'key': 'level',
                 'label': 'LEVEL',
                 'value': ticket['membershipLevel']
             })
         
         if ticket.get('cardholderName') and ticket.get('pointsBalance'):
-            content['secondaryFields'].append({
+            content.setdefault('secondaryFields', []).append({
                 'key': 'name',
                 'label': 'NAME',
                 'value': ticket['cardholderName']
@@ -340,7 +472,7 @@ class PassGenerator:
         
         # Auxiliary
         if ticket.get('memberSince'):
-            content['auxiliaryFields'].append({
+            content.setdefault('auxiliaryFields', []).append({
                 'key': 'since',
                 'label': 'MEMBER SINCE',
                 'value': self.format_date(ticket['memberSince'])
@@ -349,11 +481,13 @@ class PassGenerator:
         self.add_back_fields(content, ticket)
         return content
     
-    def generate_generic_content(self, ticket, content):
+    def generate_generic_content(self, ticket):
         """Generic pass content"""
+        content = {}
+        
         # Primary
         if ticket.get('primaryValue'):
-            content['primaryFields'].append({
+            content.setdefault('primaryFields', []).append({
                 'key': 'primary',
                 'label': ticket.get('primaryLabel', ''),
                 'value': ticket['primaryValue']
@@ -361,7 +495,7 @@ class PassGenerator:
         
         # Secondary
         if ticket.get('secondaryValue'):
-            content['secondaryFields'].append({
+            content.setdefault('secondaryFields', []).append({
                 'key': 'secondary',
                 'label': ticket.get('secondaryLabel', ''),
                 'value': ticket['secondaryValue']
@@ -372,162 +506,182 @@ class PassGenerator:
     
     def add_back_fields(self, content, ticket):
         """Add common back fields"""
-        content['backFields'].append({
+        back_fields = content.setdefault('backFields', [])
+        
+        back_fields.append({
             'key': 'organization',
             'label': 'Issued by',
             'value': ticket.get('organizationName', self.pass_config['organizationName'])
         })
         
         if ticket.get('venueAddress'):
-            content['backFields'].append({
+            back_fields.append({
                 'key': 'address',
                 'label': 'Address',
                 'value': ticket['venueAddress']
             })
         
         if ticket.get('description'):
-            content['backFields'].append({
+            back_fields.append({
                 'key': 'description',
                 'label': 'Description',
                 'value': ticket['description']
             })
         
-        content['backFields'].append({
+        back_fields.append({
             'key': 'generated',
             'label': 'Generated by',
             'value': 'PassCard App'
         })
     
-    def create_manifest(self, files):
-        """Create manifest.json with SHA1 hashes"""
+    def write_entries(self, zf, files, date_time):
+        """
+        Stream (filename, content, sha1) entries into the archive and return manifest with their SHA1 hashes.
+        sha1 is the precomputed hex digest (cached templates) or None.
+        """
         manifest = {}
-        for filename, content in files.items():
-            hash_obj = hashlib.sha1(content)
-            manifest[filename] = hash_obj.hexdigest()
+        previous = previous_sha1 = None
+        for filename, content, sha1 in files:
+            # @2x entries repeat the previous entry's object: its SHA1 is already known
+            if content is previous:
+                sha1 = previous_sha1
+            
+            info = self.zip_info(filename, date_time)
+            if isinstance(content, bytes):
+                # Already in memory: size known up front, one zlib.crc32 and one sha1 over the whole buffer
+                zf.writestr(info, content)
+                sha1 = sha1 or hashlib.sha1(content).hexdigest()
+            else:
+                src = self.open_entry(content)
+                if sha1 is None:
+                    src = HashingReader(src)
+                with zf.open(info, 'w') as dst:
+                    shutil.copyfileobj(src, dst, COPY_CHUNK_SIZE)
+                sha1 = sha1 or src.hexdigest()
+            
+            manifest[filename] = sha1
+            previous, previous_sha1 = content, sha1
         return manifest
     
+    def zip_info(self, filename, date_time):
+        """Archive entry header: DEFLATE for JSON, STORED for PNGs and the signature (nothing to gain there)"""
+        info = zipfile.ZipInfo(filename, date_time)
+        info.compress_type = zipfile.ZIP_DEFLATED if filename.endswith('.json') else zipfile.ZIP_STORED
+        info.external_attr = 0o644 << 16
+        return info
+    
     def sign_manifest(self, manifest_data):
         """Sign manifest.json using PKCS#7"""
         certs = self.load_certificates()
         
-        # Build the PKCS#7 signed data
-        signed_data = pkcs7.PKCS7SignatureBuilder().set_data(
-            manifest_data
-        ).add_signer(
-            certs['signer_cert'],
-            certs['signer_key'],
-            hashes.SHA256()
-        ).add_certificate(
-            certs['wwdr_cert']
-        ).sign(
-            serialization.Encoding.DER,
-            options=[pkcs7.PKCS7Options.DetachedSignature]
-        )
-        
-        return signed_data
+        # The signer builder is part of the cache key, so rotated certificates never reuse old signatures
+        return sign_data(certs['signer'], certs['wwdr_cert'], manifest_data)
+    
+    def image_source(self, image):
+        """Entry content for a base64-encoded image"""
+        return base64.b64decode(image)
+    
+    def image_entry(self, name, images, images_raw):
+        """Entry content for an image: from images_raw (bytes/file object) as is, else decoded base64 from images, else None"""
+        if images_raw.get(name):
+            return images_raw[name]
+        if images.get(name):
+            return self.image_source(images[name])
+        return None
+    
+    def open_entry(self, content):
+        """Readable stream over entry content (bytes or a binary file object), from the start"""
+        if isinstance(content, bytes):
+            return io.BytesIO(content)
+        content.seek(0)
+        return content
     
     def generate_placeholder_image(self):
-        """Generate minimal transparent PNG"""
-        return bytes([
-            0x89, 0x50, 0x4E, 0x47, 0x0D, 0x0A, 0x1A, 0x0A,
-            0x00, 0x00, 0x00, 0x0D, 0x49, 0x48, 0x44, 0x52,
-            0x00, 0x00, 0x00, 0x01, 0x00, 0x00, 0x00, 0x01,
-            0x08, 0x02, 0x00, 0x00, 0x00, 0x90, 0x77, 0x53,
-            0xDE, 0x00, 0x00, 0x00, 0x0C, 0x49, 0x44, 0x41,
-            0x54, 0x08, 0xD7, 0x63, 0xF8, 0x00, 0x00, 0x00,
-            0x01, 0x00, 0x01, 0x00, 0x05, 0xFE, 0xD4, 0xE7,
-            0x00, 0x00, 0x00, 0x00, 0x49, 0x45, 0x4E, 0x44,
-            0xAE, 0x42, 0x60, 0x82
-        ])
-    
-    def generate_pass(self, ticket, serial_number, images=None):
-        """Main method - generate pass"""
+        """Minimal transparent PNG"""
+        return PLACEHOLDER_PNG
+    
+    def generate_pass(self, ticket, serial_number, images=None, images_raw=None):
+        """
+        Main method - generate pass.
+        images: base64-encoded PNGs by name; images_raw: PNG bytes or binary file objects
+        (e.g. multipart uploads), used as is and taking precedence over images.
+        """
+        buffer = io.BytesIO()
+        self.generate_pass_to(buffer, ticket, serial_number, images, images_raw)
+        return buffer.getvalue()
+    
+    def generate_pass_to(self, fileobj, ticket, serial_number, images=None, images_raw=None):
+        """Generate pass and write the .pkpass archive into a binary file object"""
+        files = self.iter_pass_files(ticket, serial_number, images, images_raw)
+        # Compression is chosen per entry, see zip_info(); one timestamp for the whole archive
+        date_time = time.localtime()[:6]
+        with zipfile.ZipFile(fileobj, 'w') as zf:
+            # 3. Write entries, hashing them on the way for manifest.json
+            manifest = self.write_entries(zf, files, date_time)
+            # Sorted keys: the same entries always give the same bytes (and a cached signature)
+            manifest_json = orjson.dumps(manifest, option=orjson.OPT_SORT_KEYS)
+            zf.writestr(self.zip_info('manifest.json', date_time), manifest_json)
+            
+            # 4. Sign manifest
+            zf.writestr(self.zip_info('signature', date_time), self.sign_manifest(manifest_json))
+    
+    def iter_pass_files(self, ticket, serial_number, images=None, images_raw=None):
+        """Yield (filename, content, sha1) for pass.json and images (manifest and signature are added while archiving)"""
         images = images or {}
-        files = {}
+        images_raw = images_raw or {}
         
         # 1. Generate pass.json
         pass_json = self.generate_pass_json(ticket, serial_number)
-        files['pass.json'] = json.dumps(pass_json, indent=2).encode('utf-8')
+        yield 'pass.json', orjson.dumps(pass_json, option=orjson.OPT_INDENT_2), None
         
-        # 2. Add images
+        # 2. Add images (one decoded image alive at a time: `data` is rebound for each)
         # icon.png (required)
-        if images.get('icon'):
-            icon_data = base64.b64decode(images['icon'])
-            files['icon.png'] = icon_data
-            files['icon@2x.png'] = icon_data
-        else:
-            icon_path = os.path.join(self.templates_dir, 'icon.png')
-            if os.path.exists(icon_path):
-                with open(icon_path, 'rb') as f:
-                    icon_data = f.read()
-                files['icon.png'] = icon_data
-                files['icon@2x.png'] = icon_data
-            else:
-                placeholder = self.generate_placeholder_image()
-                files['icon.png'] = placeholder
-                files['icon@2x.png'] = placeholder
+        # Templates come with their SHA1 already computed; uploaded images are hashed while written
+        data, sha1 = self.image_entry('icon', images, images_raw), None
+        if data is None:
+            data, sha1 = read_template(os.path.join(self.templates_dir, 'icon.png'))
+        if data is None:
+            data, sha1 = PLACEHOLDER_PNG, PLACEHOLDER_SHA1
+        yield 'icon.png', data, sha1
+        yield 'icon@2x.png', data, sha1
         
         # logo.png (optional)
-        if images.get('logo'):
-            logo_data = base64.b64decode(images['logo'])
-            files['logo.png'] = logo_data
-            files['logo@2x.png'] = logo_data
-        else:
-            logo_path = os.path.join(self.templates_dir, 'logo.png')
-            if os.path.exists(logo_path):
-                with open(logo_path, 'rb') as f:
-                    logo_data = f.read()
-                files['logo.png'] = logo_data
-                files['logo@2x.png'] = logo_data
+        data, sha1 = self.image_entry('logo', images, images_raw), None
+        if data is None:
+            data, sha1 = read_template(os.path.join(self.templates_dir, 'logo.png'))
+        if data is not None:
+            yield 'logo.png', data, sha1
+            yield 'logo@2x.png', data, sha1
         
         # Type-specific images
         ticket_type = ticket.get('ticketType', 'eventTicket')
         
-        if ticket_type == 'eventTicket' and images.get('background'):
-            bg_data = base64.b64decode(images['background'])
-            files['background.png'] = bg_data
-            files['background@2x.png'] = bg_data
-        
-        if ticket_type in ('coupon', 'storeCard') and images.get('strip'):
-            strip_data = base64.b64decode(images['strip'])
-            files['strip.png'] = strip_data
-            files['strip@2x.png'] = strip_data
-        
-        if images.get('thumbnail'):
-            thumb_data = base64.b64decode(images['thumbnail'])
-            files['thumbnail.png'] = thumb_data
-            files['thumbnail@2x.png'] = thumb_data
-        
-        # 3. Create manifest.json
-        manifest = self.create_manifest(files)
-        manifest_json = json.dumps(manifest).encode('utf-8')
-        files['manifest.json'] = manifest_json
-        
-        # 4. Sign manifest
-        signature = self.sign_manifest(manifest_json)
-        files['signature'] = signature
-        
-        # 5. Create ZIP archive (.pkpass)
-        buffer = io.BytesIO()
-        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
-            for filename, content in files.items():
-                zf.writestr(filename, content)
-        
-        return buffer.getvalue()
+        if ticket_type == 'eventTicket':
+            data = self.image_entry('background', images, images_raw)
+            if data is not None:
+                yield 'background.png', data, None
+                yield 'background@2x.png', data, None
+        
+        if ticket_type in ('coupon', 'storeCard'):
+            data = self.image_entry('strip', images, images_raw)
+            if data is not None:
+                yield 'strip.png', data, None
+                yield 'strip@2x.png', data, None
+        
+        data = self.image_entry('thumbnail', images, images_raw)
+        if data is not None:
+            yield 'thumbnail.png', data, None
+            yield 'thumbnail@2x.png', data, None
     
     # Utilities
     def hex_to_rgb(self, hex_color):
         """Convert hex to rgb() string"""
-        hex_color = hex_color.lstrip('#')
-        if len(hex_color) == 6:
-            r, g, b = int(hex_color[0:2], 16), int(hex_color[2:4], 16), int(hex_color[4:6], 16)
-            return f"rgb({r}, {g}, {b})"
-        return "rgb(0, 0, 0)"
+        return hex_to_rgb_string(hex_color)
     
     def format_date(self, date_string):
         """Format date string"""
         try:
-            dt = datetime.fromisoformat(date_string.replace('Z', '+00:00'))
+            dt = parse_iso(date_string)
             return dt.strftime('%b %d, %Y')
         except:
             return date_string
@@ -535,7 +689,7 @@ class PassGenerator:
     def format_time(self, time_string):
         """Format time string"""
         try:
-            dt = datetime.fromisoformat(time_string.replace('Z', '+00:00'))
+            dt = parse_iso(time_string)
             return dt.strftime('%H:%M')
         except:
             return time_string
@@ -543,7 +697,7 @@ class PassGenerator:
     def format_datetime(self, date_string):
         """Format datetime string"""
         try:
-            dt = datetime.fromisoformat(date_string.replace('Z', '+00:00'))
+            dt = parse_iso(date_string)
             return dt.strftime('%b %d, %H:%M')
         except:
             return date_string
@@ -551,7 +705,7 @@ class PassGenerator:
     def to_iso_date(self, date_string):
         """Convert to ISO date string"""
         try:
-            dt = datetime.fromisoformat(date_string.replace('Z', '+00:00'))
+            dt = parse_iso(date_string)
             return dt.isoformat()
         except:
             return datetime.now().isoformat()